@@ -1,17 +1,27 @@
 # backend/main.py
 import os
-import json
+# Idle OpenMP threads sleep instead of spinning (must be set before faiss/torch load OpenMP).
+# Thread counts are set per library below: FAISS single-threaded, torch sized for the query encoder.
+os.environ.setdefault("OMP_WAIT_POLICY", "PASSIVE")
+import orjson
+import asyncio
+import mmap
 import logging
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime
+from functools import lru_cache
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 # Import necessary components for loading models and data
 from sentence_transformers import SentenceTransformer
+import torch
 import faiss
 import numpy as np # For numerical operations with FAISS
 from dotenv import load_dotenv
@@ -49,16 +59,102 @@ llm_model = None
 embedding_model = None
 faiss_index = None
 scheme_metadatas = None
+scheme_texts = None # Read-only mmap of scheme_texts.bin (LLM context blocks, addressed by metadata offsets)
+state_to_ids = {} # lowercased state -> np.ndarray of FAISS ids
+category_to_ids = {} # lowercased category -> np.ndarray of FAISS ids
+search_queue = None # asyncio.Queue of (query_embedding, n_results, filter_key, future) for the search batcher
+search_batcher_task = None
+# Single dedicated thread for FAISS searches (the batcher issues them one batch at a time)
+faiss_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="faiss-search")
+# Single dedicated thread for query encodes, so concurrent cache misses don't each start their own OpenMP team
+embedding_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-embed")
+health_snapshot = None # (status_code, rendered JSON body) for /health, built once resources are loaded
+
+# --- Retrieval Settings ---
+HNSW_EF_SEARCH = 64 # Candidate list size for HNSW search (recall vs. latency)
+HNSW_EF_SEARCH_MAX = 1024 # Cap on efSearch when it is widened for selective filters
+EXACT_SEARCH_MAX_IDS = 512 # Filter buckets up to this size are scored exactly instead of via HNSW
+SEARCH_BATCH_MAX_SIZE = 32 # Max queries stacked into one FAISS search call
+SEARCH_BATCH_WINDOW_S = 0.01 # How long the batcher waits to fill a batch
+MAX_K = 50 # Upper bound on results per query; k also sets the FAISS search depth
+EMBEDDING_CACHE_SIZE = 4096 # Number of distinct query embeddings kept in memory
+MAX_HISTORY_MESSAGES = 6 # Most recent conversation messages forwarded to Gemini
+EMPTY_IDS = np.empty(0, dtype='int64')
+# Instructions prepended to the retrieved context; built once instead of on every request
+SYSTEM_PROMPT = """You are YojanaSaar, a kind and knowledgeable AI advisor that helps Indian citizens discover relevant government schemes.
+
+            Based *only* on the schemes provided in the context below, suggest helpful options to the user. Explain why each scheme applies to them (e.g., for farmers, students, by state, etc).
+            Format your answer using Markdown, including headings for each suggested scheme, bullet points for details, and bold text where appropriate.
+
+            If no relevant information is found in the provided context that directly answers the user's question, politely explain that and suggest what kind of details the user can provide to get better help. Do not make up information.
+
+            ### Context:
+            """
+NO_RESULTS_ANSWER = "I couldn't find any relevant schemes in the database based on your query and filters. Please try rephrasing your question or adjusting the filters."
+BLOCKED_PROMPT_DETAIL = "The query was blocked by the safety system. This might be due to safety concerns with the prompt. Please try rephrasing your question."
+# Fields precomputed by phase1_embedding.py that the query path relies on
+REQUIRED_METADATA_KEYS = {"state_lc", "category_lc", "context_offset", "context_length", "text_offset", "text_length"}
+
+def _build_inverted_indices(metadatas: List[Dict[str, Any]]) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """Maps each lowercased state and category to the FAISS ids (metadata rows) that carry it."""
+    state_rows = defaultdict(list)
+    category_rows = defaultdict(list)
+    for i, item_meta in enumerate(metadatas):
+        state_rows[item_meta["state_lc"]].append(i)
+        category_rows[item_meta["category_lc"]].append(i)
+    return (
+        {key: np.array(ids, dtype='int64') for key, ids in state_rows.items()},
+        {key: np.array(ids, dtype='int64') for key, ids in category_rows.items()},
+    )
+
+def _embedding_num_threads() -> int:
+    """torch intra-op threads per process: EMBEDDING_NUM_THREADS if set, else torch's default split across workers."""
+    if os.getenv("EMBEDDING_NUM_THREADS"):
+        return max(1, int(os.getenv("EMBEDDING_NUM_THREADS")))
+    # torch defaults to the physical core count; share it between uvicorn workers (WEB_CONCURRENCY)
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    return max(1, torch.get_num_threads() // workers)
+
+def _build_health_snapshot() -> Tuple[int, bytes]:
+    """Renders the /health status code and JSON body from the currently loaded components."""
+    components = {
+        "embedding_model": "loaded" if embedding_model else "failed",
+        "faiss_index": "loaded" if faiss_index else "failed",
+        "faiss_index_count": faiss_index.ntotal if faiss_index else 0,
+        "scheme_metadatas": "loaded" if scheme_metadatas else "failed",
+        "scheme_metadata_count": len(scheme_metadatas) if scheme_metadatas else 0,
+        "gemini_llm": "loaded" if llm_model else "failed",
+    }
+    # Only the load flags decide health; the counts are informational
+    if all(state == "loaded" for name, state in components.items() if not name.endswith("_count")):
+        status, status_code = "ok", 200
+    else:
+        status, status_code = "degraded", 503
+    return status_code, orjson.dumps({"status": status, "components": components})
 
 # --- Lifespan Events for Loading Models and Data ---
 @app.on_event("startup")
 async def load_resources():
-    global llm_model, embedding_model, faiss_index, scheme_metadatas
+    global llm_model, embedding_model, faiss_index, scheme_metadatas, scheme_texts, state_to_ids, category_to_ids
+    global search_queue, search_batcher_task, health_snapshot
 
     logger.info("[⚙️] Starting application: Loading resources...")
+    # faiss-cpu picks its SIMD module from the CPU's instruction sets unless FAISS_OPT_LEVEL overrides it;
+    # dynamic-dispatch builds ("DD" in the compile options) select AVX2/AVX-512 kernels at runtime
+    logger.info(f"[ℹ️] FAISS build: {faiss.get_compile_options()}. CPU instruction sets: {sorted(faiss.supported_instruction_sets())}")
+    if os.getenv("FAISS_OPT_LEVEL"):
+        logger.warning(f"[⚠️] FAISS_OPT_LEVEL={os.getenv('FAISS_OPT_LEVEL')} overrides FAISS's CPU-based choice of SIMD module.")
     try:
+        # The BGE forward pass dominates per-request CPU cost, so torch keeps its own thread pool
+        torch.set_num_threads(_embedding_num_threads())
         embedding_model = SentenceTransformer("BAAI/bge-base-en-v1.5")
-        logger.info("[✅] SentenceTransformer model loaded.")
+        # Half-precision weights halve the bytes moved per forward pass; outputs are cast back to fp32 for FAISS
+        if torch.cuda.is_available():
+            embedding_model = embedding_model.half().to("cuda")
+        else:
+            torch.set_float32_matmul_precision("medium")
+            embedding_model = embedding_model.to(torch.bfloat16)
+        logger.info(f"[✅] SentenceTransformer model loaded on {embedding_model.device} ({torch.get_num_threads()} threads).")
     except Exception as e:
         logger.error(f"[❌] Error loading SentenceTransformer model: {e}")
         raise HTTPException(status_code=500, detail="Failed to load embedding model.")
@@ -67,16 +163,30 @@ async def load_resources():
         SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
         FAISS_INDEX_PATH = os.path.join(SCRIPT_DIR, "faiss_index.bin")
         METADATA_PATH = os.path.join(SCRIPT_DIR, "scheme_metadata.json")
+        TEXTS_PATH = os.path.join(SCRIPT_DIR, "scheme_texts.bin")
 
-        faiss_index = faiss.read_index(FAISS_INDEX_PATH)
+        # Memory-map the index's flat/SQ code storage read-only (IO_FLAG_MMAP_IFC, faiss >= 1.11):
+        # codes load lazily and are shared across uvicorn workers. IO_FLAG_MMAP only covers IVF lists.
+        faiss_index = faiss.read_index(FAISS_INDEX_PATH, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
         logger.info(f"[✅] FAISS index loaded. Total vectors: {faiss_index.ntotal}")
 
-        with open(METADATA_PATH, "r", encoding="utf-8") as f:
-            scheme_metadatas = json.load(f)
+        with open(METADATA_PATH, "rb") as f:
+            scheme_metadatas = orjson.loads(f.read())
         logger.info(f"[✅] Metadata loaded. Total items: {len(scheme_metadatas)}")
+        missing_keys = REQUIRED_METADATA_KEYS - scheme_metadatas[0].keys() if scheme_metadatas else set()
+        if missing_keys:
+            raise ValueError(f"Metadata is missing {sorted(missing_keys)}. Re-run phase1_embedding.py.")
+
+        # Scheme texts stay on disk; only the slices for returned schemes are paged in
+        with open(TEXTS_PATH, "rb") as f:
+            scheme_texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        logger.info(f"[✅] Scheme texts mapped. Size: {len(scheme_texts)} bytes")
+
+        state_to_ids, category_to_ids = _build_inverted_indices(scheme_metadatas)
+        logger.info(f"[✅] Filter id maps built. States: {len(state_to_ids)}, categories: {len(category_to_ids)}")
 
     except FileNotFoundError:
-        logger.error("[❌] Critical: FAISS index or metadata files not found. Run phase1_embedding.py first.")
+        logger.error("[❌] Critical: FAISS index, metadata or scheme text files not found. Run phase1_embedding.py first.")
         raise HTTPException(status_code=500, detail="Required data files not found. Please run phase1_embedding.py.")
     except Exception as e:
         logger.error(f"[❌] Error loading FAISS index or metadata: {e}")
@@ -96,11 +206,21 @@ async def load_resources():
         logger.error(f"[❌] Error loading Gemini GenerativeModel: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to load Gemini model: {e}")
 
+    search_queue = asyncio.Queue()
+    search_batcher_task = asyncio.create_task(_run_search_batcher())
+    logger.info("[✅] FAISS search batcher started.")
+
+    health_snapshot = _build_health_snapshot()
     logger.info("[✅] All resources loaded successfully. App ready.")
 
 @app.on_event("shutdown")
 async def shutdown_resources():
+    global health_snapshot
     logger.info("[👋] Shutting down application.")
+    health_snapshot = (503, orjson.dumps({"status": "shutting_down", "components": {}}))
+    # scheme_texts is left mapped: in-flight requests may still read from it, and the OS unmaps it at exit
+    if search_batcher_task:
+        search_batcher_task.cancel()
 
 
 # --- Pydantic Models for Request/Response ---
@@ -110,7 +230,7 @@ class Message(BaseModel):
 
 class QueryRequest(BaseModel):
     user_query: str
-    k: int = 5 # Number of relevant documents to retrieve
+    k: int = Field(5, ge=1, le=MAX_K) # Number of relevant documents to retrieve
     state: Optional[str] = None
     category: Optional[str] = None
     # New: For conversation history
@@ -129,97 +249,260 @@ class QueryResponse(BaseModel):
     relevant_schemes: List[SchemeDetail] = []
     # No need for query_id yet, handled by frontend history
 
+# --- Filtered FAISS Search ---
+def _filter_key(state_filter: Optional[str], category_filter: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    return (
+        state_filter.lower() if state_filter else None,
+        category_filter.lower() if category_filter else None,
+    )
+
+def _matching_ids(filter_key: Tuple[Optional[str], Optional[str]]) -> Optional[np.ndarray]:
+    """Looks up the ids matching (state, category) in the inverted indices, or None if unfiltered."""
+    state_key, category_key = filter_key
+    ids = None
+    if state_key is not None:
+        ids = state_to_ids.get(state_key, EMPTY_IDS)
+    if category_key is not None:
+        category_ids = category_to_ids.get(category_key, EMPTY_IDS)
+        ids = category_ids if ids is None else np.intersect1d(ids, category_ids, assume_unique=True)
+    return ids
+
+def _exact_search(queries: np.ndarray, ids: np.ndarray, n: int) -> np.ndarray:
+    """Scores every id in a small filter bucket exactly; returns (len(queries), n) ids padded with -1."""
+    vectors = faiss_index.reconstruct_batch(ids)
+    scores = queries @ vectors.T # Inner product == cosine on normalized vectors
+    top = np.argsort(-scores, axis=1)[:, :n]
+    indices = np.full((len(queries), n), -1, dtype='int64')
+    indices[:, :top.shape[1]] = ids[top]
+    return indices
+
+def _filtered_search(queries: np.ndarray, ids: Optional[np.ndarray], n: int) -> np.ndarray:
+    """Searches restricted to `ids` (None = unfiltered), choosing exact scoring or a widened HNSW walk."""
+    if ids is None:
+        params = faiss.SearchParametersHNSW(efSearch=HNSW_EF_SEARCH)
+        return faiss_index.search(queries, n, params=params)[1]
+    if ids.size <= EXACT_SEARCH_MAX_IDS:
+        # A filtered graph walk misses matches in small buckets; scoring them all is cheap and exact
+        return _exact_search(queries, ids, n)
+    # Fewer matching vectors means the walk must visit more candidates to find k of them
+    ef_search = min(HNSW_EF_SEARCH_MAX, int(np.ceil(HNSW_EF_SEARCH * faiss_index.ntotal / ids.size)))
+    # IDSelectorBatch is a hash-set lookup; IDSelectorArray would scan the id list on every check
+    sel = faiss.IDSelectorBatch(ids)
+    params = faiss.SearchParametersHNSW(efSearch=max(ef_search, n), sel=sel)
+    return faiss_index.search(queries, n, params=params)[1]
+
+def _search_grouped(
+    embeddings: np.ndarray,
+    n_results: List[int],
+    groups: Dict[Tuple[Optional[str], Optional[str]], List[int]]
+) -> List[np.ndarray]:
+    """Runs one FAISS search per filter group so non-matching vectors are skipped inside the index.
+
+    A failing group yields its exception for its own rows only; other groups are unaffected.
+    """
+    # OpenMP thread counts are per calling thread. This runs on the dedicated faiss_executor thread,
+    # so pinning FAISS to one thread here never leaks into the threads torch encodes queries on.
+    faiss.omp_set_num_threads(1)
+    results: List[Any] = [None] * len(embeddings)
+    for filter_key, rows in groups.items():
+        # Each group only searches as deep as its own largest k, so one request can't widen another's search
+        n = max(n_results[row] for row in rows)
+        try:
+            group_indices = _filtered_search(embeddings[rows], _matching_ids(filter_key), n)
+        except Exception as e:
+            logger.error(f"[❌] FAISS search failed for filter {filter_key} ({len(rows)} queries): {e}")
+            for row in rows:
+                results[row] = e
+            continue
+        for row, row_indices in zip(rows, group_indices):
+            results[row] = row_indices[:n_results[row]]
+    return results
+
+def _fail_futures(items, error: BaseException):
+    for *_, future in items:
+        if not future.done():
+            future.set_exception(error)
+
+# --- Batched FAISS Search ---
+async def _run_search_batcher():
+    """Collects queued query embeddings and searches them in as few FAISS calls as possible."""
+    loop = asyncio.get_running_loop()
+    batch = []
+    try:
+        while True:
+            batch = [await search_queue.get()]
+            deadline = loop.time() + SEARCH_BATCH_WINDOW_S
+            while len(batch) < SEARCH_BATCH_MAX_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(search_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                embeddings = np.vstack([query_embedding for query_embedding, _, _, _ in batch])
+                n_results = [n for _, n, _, _ in batch]
+                # Queries sharing the same filters share one search call
+                groups: Dict[Tuple[Optional[str], Optional[str]], List[int]] = {}
+                for row, (_, _, filter_key, _) in enumerate(batch):
+                    groups.setdefault(filter_key, []).append(row)
+                results = await loop.run_in_executor(faiss_executor, _search_grouped, embeddings, n_results, groups)
+            except Exception as e:
+                logger.error(f"[❌] Batched FAISS search failed for {len(batch)} queries: {e}")
+                _fail_futures(batch, e)
+                continue
+
+            for row, (_, _, _, future) in enumerate(batch):
+                if future.done(): # The request may have been cancelled while waiting
+                    continue
+                if isinstance(results[row], Exception):
+                    future.set_exception(results[row])
+                else:
+                    future.set_result(results[row])
+            batch = []
+    except asyncio.CancelledError:
+        # Fail everything in hand or still queued so no request waits on a future that never resolves
+        error = RuntimeError("Search batcher stopped.")
+        _fail_futures(batch, error)
+        while not search_queue.empty():
+            _fail_futures([search_queue.get_nowait()], error)
+        raise
+
+async def submit_to_batcher(
+    query_embedding: np.ndarray,
+    n_results: int,
+    filter_key: Tuple[Optional[str], Optional[str]] = (None, None)
+) -> np.ndarray:
+    """Queues one (1, d) query embedding for the next batched search and returns its row of FAISS ids."""
+    if search_batcher_task is None or search_batcher_task.done():
+        raise RuntimeError("Search batcher is not running.")
+    future = asyncio.get_running_loop().create_future()
+    await search_queue.put((query_embedding, n_results, filter_key, future))
+    return await future
+
 # --- Core RAG Logic ---
-def get_rag_response(
+@lru_cache(maxsize=EMBEDDING_CACHE_SIZE)
+def _embed_cached(normalized_query: str) -> bytes:
+    """Encodes and normalizes a query once; stored as bytes so cached vectors can't be mutated."""
+    query_embedding = embedding_model.encode([normalized_query], convert_to_tensor=False).astype('float32')
+    faiss.normalize_L2(query_embedding) # Index stores unit vectors; search by cosine
+    return query_embedding.tobytes()
+
+def _embed_query(user_query: str) -> np.ndarray:
+    """Embeds the query for cosine search. CPU-bound on a cache miss, so run it off the event loop."""
+    key = user_query.strip().lower()
+    return np.frombuffer(_embed_cached(key), dtype='float32').reshape(1, -1).copy()
+
+def _read_text(offset: int, length: int) -> str:
+    return scheme_texts[offset:offset + length].decode("utf-8")
+
+def _lookup_results(indices: np.ndarray) -> List[Dict[str, Any]]:
+    retrieved_items = []
+    for i in indices:
+        if i == -1: # FAISS pads with -1 when fewer than k vectors match the filters
+            continue
+        if 0 <= i < len(scheme_metadatas):
+            retrieved_items.append(scheme_metadatas[i])
+        else:
+            logger.warning(f"FAISS returned out-of-bounds index: {i}")
+    return retrieved_items
+
+def _build_history_parts(conversation_history: List[Message], user_query: str) -> List[Dict[str, Any]]:
+    """Keeps the last few messages, drops exact repeats and merges consecutive same-role messages."""
+    history = conversation_history
+    # The frontend includes the current question as the last history message; it is sent separately below.
+    # Drop it before slicing so MAX_HISTORY_MESSAGES prior messages are kept.
+    if history and history[-1].role == "user" and history[-1].content == user_query:
+        history = history[:-1]
+    history = history[-MAX_HISTORY_MESSAGES:]
+
+    history_parts: List[Dict[str, Any]] = []
+    previous_content = None
+    for msg in history:
+        if msg.content == previous_content:
+            continue
+        previous_content = msg.content
+        if history_parts and history_parts[-1]["role"] == msg.role:
+            history_parts[-1]["parts"].append(msg.content)
+        else:
+            history_parts.append({"role": msg.role, "parts": [msg.content]})
+    return history_parts
+
+async def _prepare_rag_prompt(
     user_query: str,
     k: int,
     state_filter: Optional[str],
     category_filter: Optional[str],
     conversation_history: List[Message]
-) -> QueryResponse:
-    if embedding_model is None or faiss_index is None or scheme_metadatas is None or llm_model is None:
-        raise RuntimeError("Core components not loaded. Application is not ready.")
-
-    try:
-        query_embedding = embedding_model.encode([user_query], convert_to_tensor=False).astype('float32')
-        distances, indices = faiss_index.search(query_embedding, k * 2) # Retrieve more to filter
-
-        retrieved_items = []
-        for i in indices[0]:
-            if 0 <= i < len(scheme_metadatas):
-                retrieved_items.append(scheme_metadatas[i])
-            else:
-                logger.warning(f"FAISS returned out-of-bounds index: {i}")
-
-        filtered_items = []
-        for item_meta in retrieved_items:
-            match = True
-            if state_filter and item_meta.get("state", "").lower() != state_filter.lower():
-                match = False
-            if category_filter and item_meta.get("category", "").lower() != category_filter.lower():
-                match = False
-            if match:
-                filtered_items.append(item_meta)
-
-        relevant_items_for_llm = filtered_items[:k]
-
-        if not relevant_items_for_llm:
-            logger.info("No relevant documents found after filtering.")
-            return QueryResponse(
-                answer="I couldn't find any relevant schemes in the database based on your query and filters. Please try rephrasing your question or adjusting the filters.",
-                relevant_schemes=[]
-            )
-
-        context_items = []
-        response_scheme_details: List[SchemeDetail] = []
-        for item_meta in relevant_items_for_llm:
-            context_items.append(
-                f"### Scheme: {item_meta.get('title', 'N/A')}\n" # Using Markdown heading
-                f"Description: {item_meta.get('full_document_text', 'N/A')}\n"
-                f"Category: {item_meta.get('category', 'N/A')}\n"
-                f"Department: {item_meta.get('department', 'N/A')}\n"
-                f"State: {item_meta.get('state', 'N/A')}\n"
-                f"Link: {item_meta.get('link', 'N/A')}"
-            )
-            response_scheme_details.append(
-                SchemeDetail(
-                    title=item_meta.get("title", "N/A"),
-                    link=item_meta.get("link"),
-                    category=item_meta.get("category"),
-                    department=item_meta.get("department"),
-                    state=item_meta.get("state"),
-                    full_document_text=item_meta.get("full_document_text")
-                )
+) -> Tuple[List[SchemeDetail], Optional[List[Dict[str, Any]]]]:
+    """Retrieves relevant schemes and builds the Gemini prompt. The prompt is None when nothing matched."""
+    filter_key = _filter_key(state_filter, category_filter)
+    matching_ids = _matching_ids(filter_key)
+    if matching_ids is not None and matching_ids.size == 0:
+        # No scheme matches the filters: skip embedding and search entirely
+        relevant_items_for_llm = []
+    else:
+        query_embedding = await asyncio.get_running_loop().run_in_executor(embedding_executor, _embed_query, user_query)
+        indices = await submit_to_batcher(query_embedding, k, filter_key)
+        relevant_items_for_llm = _lookup_results(indices)
+
+    if not relevant_items_for_llm:
+        logger.info("No relevant documents found after filtering.")
+        return [], None
+
+    context_items = []
+    response_scheme_details: List[SchemeDetail] = []
+    for item_meta in relevant_items_for_llm:
+        context_items.append(_read_text(item_meta["context_offset"], item_meta["context_length"])) # Formatted at ingest time by phase1
+        response_scheme_details.append(
+            SchemeDetail(
+                title=item_meta.get("title", "N/A"),
+                link=item_meta.get("link"),
+                category=item_meta.get("category"),
+                department=item_meta.get("department"),
+                state=item_meta.get("state"),
+                full_document_text=_read_text(item_meta["text_offset"], item_meta["text_length"])
             )
+        )
 
-        context = "\n\n---\n\n".join(context_items)
+    context = "\n\n---\n\n".join(context_items)
 
-        # Build the conversation parts for Gemini
-        # Gemini expects a specific format for history, e.g., [{"role": "user", "parts": ["text"]}, {"role": "model", "parts": ["text"]}]
-        gemini_history_parts = []
-        for msg in conversation_history:
-            gemini_history_parts.append({"role": msg.role, "parts": [msg.content]})
+    # Build the conversation parts for Gemini
+    # Gemini expects a specific format for history, e.g., [{"role": "user", "parts": ["text"]}, {"role": "model", "parts": ["text"]}]
+    gemini_history_parts = _build_history_parts(conversation_history, user_query)
 
-        # New prompt for Markdown output and incorporating history
-        prompt_parts = [
-            {"role": "user", "parts": ["""You are YojanaSaar, a kind and knowledgeable AI advisor that helps Indian citizens discover relevant government schemes.
-
-            Based *only* on the schemes provided in the context below, suggest helpful options to the user. Explain why each scheme applies to them (e.g., for farmers, students, by state, etc).
-            Format your answer using Markdown, including headings for each suggested scheme, bullet points for details, and bold text where appropriate.
+    # Prompt for Markdown output and incorporating history
+    prompt_parts = [
+        {"role": "user", "parts": [SYSTEM_PROMPT + context]},
+        # Your conversation history goes here
+        *gemini_history_parts,
+        {"role": "user", "parts": [f"### Current Question:\n{user_query}"]},
+        {"role": "model", "parts": ["### Answer:"]} # To guide Gemini to start its answer with this heading
+    ]
+    return response_scheme_details, prompt_parts
 
-            If no relevant information is found in the provided context that directly answers the user's question, politely explain that and suggest what kind of details the user can provide to get better help. Do not make up information.
+async def get_rag_response(
+    user_query: str,
+    k: int,
+    state_filter: Optional[str],
+    category_filter: Optional[str],
+    conversation_history: List[Message]
+) -> QueryResponse:
+    if embedding_model is None or faiss_index is None or scheme_metadatas is None or llm_model is None:
+        raise RuntimeError("Core components not loaded. Application is not ready.")
 
-            ### Context:
-            """ + context]},
-            # Your conversation history goes here
-            *gemini_history_parts,
-            {"role": "user", "parts": [f"### Current Question:\n{user_query}"]},
-            {"role": "model", "parts": ["### Answer:"]} # To guide Gemini to start its answer with this heading
-        ]
+    try:
+        response_scheme_details, prompt_parts = await _prepare_rag_prompt(
+            user_query, k, state_filter, category_filter, conversation_history
+        )
+        if prompt_parts is None:
+            return QueryResponse(answer=NO_RESULTS_ANSWER, relevant_schemes=[])
 
         logger.info(f"Sending prompt to Gemini for query: {user_query}")
-        # Use generate_content with parts for history
-        answer_response = llm_model.generate_content(prompt_parts)
+        # Use the async API with parts for history so the event loop stays free during the LLM round trip
+        answer_response = await llm_model.generate_content_async(prompt_parts)
         response_text = answer_response.text
 
         logger.info("Gemini response received.")
@@ -227,7 +510,7 @@ def get_rag_response(
 
     except genai_types.BlockedPromptException as e:
         logger.error(f"[❌] Gemini API Error (Blocked Prompt): {e}", exc_info=True)
-        raise HTTPException(status_code=400, detail=f"The query was blocked by the safety system. This might be due to safety concerns with the prompt. Please try rephrasing your question.")
+        raise HTTPException(status_code=400, detail=BLOCKED_PROMPT_DETAIL)
     except genai_types.APIError as e:
         logger.error(f"[❌] Gemini API Error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error communicating with the Gemini API. Please try again later. Details: {e}")
@@ -235,6 +518,54 @@ def get_rag_response(
         logger.error(f"[❌] An unexpected error occurred during the query process for '{user_query}': {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred during the query process: {e}")
 
+def _sse_event(event: str, data: Any) -> bytes:
+    """Formats one Server-Sent Event with a JSON payload (JSON keeps newlines in tokens intact)."""
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+async def stream_rag_response(
+    user_query: str,
+    k: int,
+    state_filter: Optional[str],
+    category_filter: Optional[str],
+    conversation_history: List[Message]
+) -> StreamingResponse:
+    """Streams the answer as Server-Sent Events: one "schemes" event, then "token" events, then "done" or "error"."""
+    if embedding_model is None or faiss_index is None or scheme_metadatas is None or llm_model is None:
+        raise RuntimeError("Core components not loaded. Application is not ready.")
+
+    try:
+        response_scheme_details, prompt_parts = await _prepare_rag_prompt(
+            user_query, k, state_filter, category_filter, conversation_history
+        )
+    except Exception as e:
+        logger.error(f"[❌] An unexpected error occurred during retrieval for '{user_query}': {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred during the query process: {e}")
+
+    async def token_generator():
+        # Schemes go first so the client can render cards while the answer is still generating
+        yield _sse_event("schemes", jsonable_encoder(response_scheme_details))
+        if prompt_parts is None:
+            yield _sse_event("token", NO_RESULTS_ANSWER)
+            yield _sse_event("done", {})
+            return
+
+        try:
+            logger.info(f"Streaming Gemini response for query: {user_query}")
+            answer_response = await llm_model.generate_content_async(prompt_parts, stream=True)
+            async for chunk in answer_response:
+                yield _sse_event("token", chunk.text)
+            logger.info("Gemini stream finished.")
+            yield _sse_event("done", {})
+        except genai_types.BlockedPromptException as e:
+            # Headers are already sent, so errors are reported in-band instead of as an HTTP status
+            logger.error(f"[❌] Gemini API Error (Blocked Prompt): {e}", exc_info=True)
+            yield _sse_event("error", {"detail": BLOCKED_PROMPT_DETAIL})
+        except Exception as e:
+            logger.error(f"[❌] Error while streaming the Gemini response for '{user_query}': {e}", exc_info=True)
+            yield _sse_event("error", {"detail": f"Error communicating with the Gemini API. Please try again later. Details: {e}"})
+
+    return StreamingResponse(token_generator(), media_type="text/event-stream")
+
 
 # --- API Endpoints ---
 
@@ -244,24 +575,9 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Checks the health of the application and its dependencies."""
-    status = {"status": "ok", "components": {}}
-
-    status["components"]["embedding_model"] = "loaded" if embedding_model else "failed"
-    status["components"]["faiss_index"] = "loaded" if faiss_index else "failed"
-    status["components"]["faiss_index_count"] = faiss_index.ntotal if faiss_index else 0
-    status["components"]["scheme_metadatas"] = "loaded" if scheme_metadatas else "failed"
-    status["components"]["scheme_metadata_count"] = len(scheme_metadatas) if scheme_metadatas else 0
-    status["components"]["gemini_llm"] = "loaded" if llm_model else "failed"
-
-    if all(comp == "loaded" for comp in status["components"].values()):
-        status["status"] = "ok"
-        status_code = 200
-    else:
-        status["status"] = "degraded"
-        status_code = 503
-
-    return JSONResponse(content=status, status_code=status_code)
+    """Checks the health of the application and its dependencies (snapshot taken at startup)."""
+    status_code, body = health_snapshot or _build_health_snapshot()
+    return Response(content=body, status_code=status_code, media_type="application/json")
 
 @app.post("/query", response_model=QueryResponse)
 async def query_schemes(request: QueryRequest):
@@ -270,11 +586,26 @@ async def query_schemes(request: QueryRequest):
     then returns relevant Indian government schemes using RAG with Markdown formatting.
     """
     logger.info(f"Received query: '{request.user_query}' with k={request.k}, state='{request.state}', category='{request.category}'. History length: {len(request.conversation_history)}")
-    response = get_rag_response(
+    response = await get_rag_response(
         request.user_query,
         request.k,
         request.state,
         request.category,
         request.conversation_history # Pass the conversation history
     )
-    return response
\ No newline at end of file
+    return response
+
+@app.post("/query/stream")
+async def query_schemes_stream(request: QueryRequest):
+    """
+    Same inputs as /query, but streams the answer as Server-Sent Events so the
+    first tokens arrive as soon as Gemini produces them.
+    """
+    logger.info(f"Received streaming query: '{request.user_query}' with k={request.k}, state='{request.state}', category='{request.category}'. History length: {len(request.conversation_history)}")
+    return await stream_rag_response(
+        request.user_query,
+        request.k,
+        request.state,
+        request.category,
+        request.conversation_history
+    )
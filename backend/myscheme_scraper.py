@@ -1,6 +1,8 @@
+import asyncio
 import requests
+import aiohttp
 import json
-import time
+import orjson
 
 headers = {
     "accept": "application/json, text/plain, */*",
@@ -13,113 +15,125 @@ headers = {
 
 base_url = "https://api.myscheme.gov.in/search/v4/schemes"
 output_file = "myscheme_api_data.json"
+max_concurrent_requests = 8 # Politeness budget: pages in flight at once
+
+def parse_scheme(s):
+    """Convert one raw API item into our flat scheme dictionary"""
+    fields = s.get("fields", {}) # Get the 'fields' dictionary
+
+    # Extract Title and Description
+    title = fields.get("schemeName", "N/A")
+    description = fields.get("briefDescription", "N/A")
+
+    # Extract Department (prefer nodalMinistryName, fallback to beneficiaryState)
+    department = fields.get("nodalMinistryName", "N/A")
+    if department is None or department == "N/A":
+        beneficiary_state_list = fields.get("beneficiaryState", [])
+        if isinstance(beneficiary_state_list, list) and beneficiary_state_list:
+            department = ", ".join(beneficiary_state_list)
+        else:
+            department = "N/A" # Default if neither is found or state list is empty
+
+    # Construct Link
+    slug = fields.get("slug")
+    link = f"https://www.myscheme.gov.in/schemes/{slug}" if slug else "N/A"
+
+    # Extract Category (join list into string if it's a list)
+    category_data = fields.get("schemeCategory", "N/A")
+    if isinstance(category_data, list):
+        category = ", ".join(category_data)
+    else:
+        category = category_data
+
+    # Extract State (join list into string if it's a list)
+    state_data = fields.get("beneficiaryState", "N/A")
+    if isinstance(state_data, list):
+        state = ", ".join(state_data)
+    else:
+        state = state_data
+
+    # Eligibility (age object is complex, keep as raw for now)
+    eligibility_age = fields.get("age", "N/A")
+
+    scheme_info = {
+        "title": title,
+        "description": description,
+        "department": department,
+        "link": link,
+        "benefits": "N/A", # Not clearly available in provided snippet
+        "eligibility": eligibility_age, # Represents age-based eligibility, more parsing needed for full detail
+        "category": category,
+        "state": state,
+        "gender": "N/A", # Not clearly available as a direct field
+        "caste": "N/A", # Not clearly available as a direct field (only within age obj)
+        "location": state, # Using state as the primary location info
+    }
+    return scheme_info
+
+async def fetch_page(session, semaphore, offset, page_size):
+    """Fetch one page of results; the semaphore caps how many requests are in flight"""
+    params = {
+        "lang": "en",
+        "from": offset,
+        "size": page_size,
+    }
+    async with semaphore:
+        print(f"[🔄] Fetching page {offset//page_size + 1} (offset: {offset})...")
+        async with session.get(base_url, params=params) as response:
+            if response.status != 200:
+                print(f"[❌] Error fetching data at offset {offset}: {response.status}")
+                print(f"[❌] Response: {(await response.text())[:200]}...")
+                return None
+            return await response.json(loads=orjson.loads, content_type=None)
+
+async def fetch_all_pages(page_size=20):
+    """Probe the first page to learn the total, then fetch the remaining pages concurrently"""
+    semaphore = asyncio.Semaphore(max_concurrent_requests)
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(headers=headers, timeout=timeout) as session:
+        first_page = await fetch_page(session, semaphore, 0, page_size)
+        if first_page is None:
+            return []
+
+        total_hits = first_page.get("data", {}).get("summary", {}).get("total", 0)
+        print(f"[📊] API reports {total_hits} schemes in total")
+
+        other_pages = await asyncio.gather(
+            *[fetch_page(session, semaphore, offset, page_size) for offset in range(page_size, total_hits, page_size)],
+            return_exceptions=True,
+        )
+    return [first_page, *other_pages]
 
 def fetch_all_schemes():
     """Fetch all schemes using the correct API structure"""
     all_schemes = []
-    page_size = 20
-    offset = 0
     
     print("[🚀] Fetching schemes from MyScheme API...")
     
-    while True:
-        params = {
-            "lang": "en",
-            "from": offset,
-            "size": page_size,
-        }
-        
-        try:
-            print(f"[🔄] Fetching page {offset//page_size + 1} (offset: {offset})...")
-            response = requests.get(base_url, headers=headers, params=params, timeout=30)
-            
-            if response.status_code != 200:
-                print(f"[❌] Error fetching data: {response.status_code}")
-                print(f"[❌] Response: {response.text[:200]}...")
-                break
-            
-            data = response.json()
-            
-            schemes = data.get("data", {}).get("hits", {}).get("items", [])
-            
-            if not schemes:
-                print("[✅] No more schemes found. Fetch complete.")
-                break
-            
-            print(f"[📦] Found {len(schemes)} schemes on this page")
-            
-            for s in schemes:
-                if not isinstance(s, dict):
-                    print(f"[⚠️] Skipping malformed scheme entry (not a dictionary): {s}")
-                    continue 
-
-                fields = s.get("fields", {}) # Get the 'fields' dictionary
-                
-                # Extract Title and Description
-                title = fields.get("schemeName", "N/A")
-                description = fields.get("briefDescription", "N/A")
-
-                # Extract Department (prefer nodalMinistryName, fallback to beneficiaryState)
-                department = fields.get("nodalMinistryName", "N/A")
-                if department is None or department == "N/A":
-                    beneficiary_state_list = fields.get("beneficiaryState", [])
-                    if isinstance(beneficiary_state_list, list) and beneficiary_state_list:
-                        department = ", ".join(beneficiary_state_list)
-                    else:
-                        department = "N/A" # Default if neither is found or state list is empty
-
-                # Construct Link
-                slug = fields.get("slug")
-                link = f"https://www.myscheme.gov.in/schemes/{slug}" if slug else "N/A"
-
-                # Extract Category (join list into string if it's a list)
-                category_data = fields.get("schemeCategory", "N/A")
-                if isinstance(category_data, list):
-                    category = ", ".join(category_data)
-                else:
-                    category = category_data
-
-                # Extract State (join list into string if it's a list)
-                state_data = fields.get("beneficiaryState", "N/A")
-                if isinstance(state_data, list):
-                    state = ", ".join(state_data)
-                else:
-                    state = state_data
-
-                # Eligibility (age object is complex, keep as raw for now)
-                eligibility_age = fields.get("age", "N/A")
-
-                scheme_info = {
-                    "title": title,
-                    "description": description,
-                    "department": department,
-                    "link": link,
-                    "benefits": "N/A", # Not clearly available in provided snippet
-                    "eligibility": eligibility_age, # Represents age-based eligibility, more parsing needed for full detail
-                    "category": category,
-                    "state": state,
-                    "gender": "N/A", # Not clearly available as a direct field
-                    "caste": "N/A", # Not clearly available as a direct field (only within age obj)
-                    "location": state, # Using state as the primary location info
-                }
-                all_schemes.append(scheme_info)
-            
-            offset += page_size
-            print(f"[📊] Total schemes collected: {len(all_schemes)}")
-            
-            total_hits = data.get("data", {}).get("summary", {}).get("total", 0)
-            if len(all_schemes) >= total_hits:
-                print("[✅] All schemes fetched based on total count.")
-                break
-            
-            time.sleep(1) # Be polite to the API
-            
-        except Exception as e:
-            print(f"[❌] Exception occurred: {e}")
-            break
+    try:
+        pages = asyncio.run(fetch_all_pages())
+    except Exception as e:
+        print(f"[❌] Exception occurred: {e}")
+        pages = []
+
+    for page in pages:
+        if isinstance(page, Exception):
+            print(f"[❌] Exception occurred while fetching a page: {page}")
+            continue
+        if page is None:
+            continue
+
+        schemes = page.get("data", {}).get("hits", {}).get("items", [])
+        for s in schemes:
+            if not isinstance(s, dict):
+                print(f"[⚠️] Skipping malformed scheme entry (not a dictionary): {s}")
+                continue 
+            all_schemes.append(parse_scheme(s))
+
+    print(f"[📊] Total schemes collected: {len(all_schemes)}")
     
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(all_schemes, f, indent=4, ensure_ascii=False)
+    with open(output_file, "wb") as f:
+        f.write(orjson.dumps(all_schemes, option=orjson.OPT_INDENT_2)) # orjson always writes UTF-8, no ASCII escaping
     
     print(f"[💾] Saved {len(all_schemes)} schemes to '{output_file}'")
     
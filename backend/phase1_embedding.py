@@ -1,5 +1,6 @@
 import os
-import json
+import orjson
+import torch
 from tqdm import tqdm
 from sentence_transformers import SentenceTransformer
 import faiss # Import FAISS
@@ -13,16 +14,17 @@ data_file_path = os.path.join(SCRIPT_DIR, DATA_FILE)
 # Define paths for FAISS index and metadata
 FAISS_INDEX_PATH = os.path.join(SCRIPT_DIR, "faiss_index.bin")
 METADATA_PATH = os.path.join(SCRIPT_DIR, "scheme_metadata.json")
+TEXTS_PATH = os.path.join(SCRIPT_DIR, "scheme_texts.bin")
 
 # Load data
 try:
-    with open(data_file_path, "r", encoding="utf-8") as f:
-        raw_data = json.load(f)
+    with open(data_file_path, "rb") as f:
+        raw_data = orjson.loads(f.read())
     print(f"[✅] Successfully loaded data from '{DATA_FILE}'. Total items: {len(raw_data)}")
 except FileNotFoundError:
     print(f"[❌] Error: '{DATA_FILE}' not found. Please run myscheme_scraper.py first.")
     exit(1)
-except json.JSONDecodeError:
+except orjson.JSONDecodeError:
     print(f"[❌] Error: Could not decode JSON from '{DATA_FILE}'. Check file integrity.")
     exit(1)
 except Exception as e:
@@ -41,6 +43,7 @@ if not cleaned_data:
     exit(1)
 
 documents, metadatas = [], []
+text_chunks, text_blob_size = [], 0 # UTF-8 context blocks concatenated into TEXTS_PATH
 for i, item in enumerate(cleaned_data):
     # Construct a comprehensive document string for embedding
     doc = "\n".join([
@@ -53,6 +56,20 @@ for i, item in enumerate(cleaned_data):
         f"Benefits: {item.get('benefits', '')}"
     ])
     documents.append(doc)
+    # Pre-formatted context block the API passes to the LLM as-is.
+    # The full document text is a slice of it, so only the block is stored.
+    context_prefix = (
+        f"### Scheme: {item.get('title', '')}\n" # Using Markdown heading
+        f"Description: "
+    )
+    llm_context_block = (
+        f"{context_prefix}{doc}\n"
+        f"Category: {item.get('category', '')}\n"
+        f"Department: {item.get('department', '')}\n"
+        f"State: {item.get('state', '')}\n"
+        f"Link: {item.get('link', '')}"
+    ).encode("utf-8")
+    text_offset = text_blob_size + len(context_prefix.encode("utf-8"))
     metadatas.append({
         "original_index": i, # Keep original index for debugging if needed
         "title": item.get("title", ""),
@@ -60,8 +77,17 @@ for i, item in enumerate(cleaned_data):
         "category": item.get("category", ""),
         "department": item.get("department", ""),
         "state": item.get("state", ""),
-        "full_document_text": doc # Store the full document text for retrieval
+        # Lowercased copies for case-insensitive filtering without per-query .lower()
+        "state_lc": (item.get("state") or "").lower(),
+        "category_lc": (item.get("category") or "").lower(),
+        # Byte ranges into TEXTS_PATH; the API reads only the rows it returns
+        "context_offset": text_blob_size,
+        "context_length": len(llm_context_block),
+        "text_offset": text_offset,
+        "text_length": len(doc.encode("utf-8")),
     })
+    text_chunks.append(llm_context_block)
+    text_blob_size += len(llm_context_block)
 
 print(f"[⚙️] Prepared {len(documents)} documents for embedding.")
 
@@ -75,25 +101,42 @@ except Exception as e:
     exit(1)
 
 print(f"[🚀] Generating embeddings for {len(documents)} documents...")
-# Generate embeddings in batches for memory efficiency
-batch_size = 100 # Adjust as needed based on your system's memory
-all_embeddings = []
-for i in tqdm(range(0, len(documents), batch_size), desc="Generating embeddings"):
-    batch_docs = documents[i:i + batch_size]
-    embeddings = model.encode(batch_docs, convert_to_tensor=False)
-    all_embeddings.extend(embeddings)
-
-embeddings_np = np.array(all_embeddings).astype('float32')
-dimension = embeddings_np.shape[1]
+# Let SentenceTransformer batch internally; larger batches keep the GPU busy.
+# BGE is trained for cosine similarity: normalize so inner product == cosine.
+# Each chunk is written straight into a preallocated matrix, so the full corpus is never copied twice.
+batch_size = 256 # Adjust as needed based on your GPU/CPU memory
+chunk_size = batch_size * 16 # Documents per encode() call
+device = "cuda" if torch.cuda.is_available() else "cpu"
+dimension = model.get_sentence_embedding_dimension()
+embeddings_np = np.empty((len(documents), dimension), dtype='float32')
+for i in tqdm(range(0, len(documents), chunk_size), desc="Generating embeddings"):
+    batch_docs = documents[i:i + chunk_size]
+    embeddings_np[i:i + len(batch_docs)] = model.encode(
+        batch_docs,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        device=device,
+    )
 
 # === FAISS Indexing ===
 print(f"[🛠️] Creating FAISS index with dimension {dimension}...")
-# Use IndexFlatL2 for simple L2 (Euclidean) distance similarity search
-index = faiss.IndexFlatL2(dimension)
+# Use an HNSW graph index so queries walk a graph instead of scanning every vector.
+# Inner product on normalized vectors gives cosine similarity.
+# Vectors are stored as 8-bit scalar-quantized codes (4x smaller than fp32) to cut memory bandwidth.
+HNSW_M = 32 # Number of neighbours per node in the HNSW graph
+hnsw_index = faiss.IndexHNSWSQ(dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+hnsw_index.hnsw.efConstruction = 200 # Higher = better graph quality, slower build
+# Wrap with explicit ids (= metadata row) so the API can filter by id during search
+index = faiss.IndexIDMap2(hnsw_index)
+
+# The scalar quantizer learns per-dimension value ranges before vectors can be added
+print("[🎓] Training scalar quantizer...")
+index.train(embeddings_np)
 
 # Add embeddings to the FAISS index
 print(f"[➕] Adding {len(embeddings_np)} embeddings to FAISS index...")
-index.add(embeddings_np)
+index.add_with_ids(embeddings_np, np.arange(len(embeddings_np), dtype='int64'))
 print(f"[✅] FAISS index created and populated. Total vectors: {index.ntotal}")
 
 # === Save FAISS Index and Metadata ===
@@ -105,11 +148,19 @@ except Exception as e:
     exit(1)
 
 try:
-    with open(METADATA_PATH, "w", encoding="utf-8") as f:
-        json.dump(metadatas, f, indent=4)
+    with open(METADATA_PATH, "wb") as f:
+        f.write(orjson.dumps(metadatas, option=orjson.OPT_INDENT_2))
     print(f"[💾] Metadata saved to '{METADATA_PATH}'")
 except Exception as e:
     print(f"[❌] Error saving metadata: {e}")
     exit(1)
 
+try:
+    with open(TEXTS_PATH, "wb") as f:
+        f.write(b"".join(text_chunks))
+    print(f"[💾] Scheme texts saved to '{TEXTS_PATH}' ({text_blob_size} bytes)")
+except Exception as e:
+    print(f"[❌] Error saving scheme texts: {e}")
+    exit(1)
+
 print("\n[🎉] Phase 1 (Embedding and FAISS Indexing) completed successfully!")
\ No newline at end of file